@@ -4,14 +4,21 @@ Agent / REPL that imports tools from canvas_tools.py
 
 from __future__ import annotations
 
-import json
+import asyncio
 import os
-from typing import List, Dict, Any
+import re
+from typing import List, Dict, Any, Optional, Tuple
 
+import orjson
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-from canvas_tools import TOOLS, execute_function
+from canvas_tools import (
+    TOOLS,
+    execute_function,
+    get_submission_statuses,
+    resolve_course_id,
+)
 
 load_dotenv()
 
@@ -25,54 +32,247 @@ DAYS_AHEAD_DEFAULT = int(os.getenv("DAYS_AHEAD_DEFAULT"))
 if not (LM_BASE_URL and LM_API_KEY and LM_MODEL):
     raise RuntimeError("LM_BASE_URL, LM_API_KEY, and LM_MODEL must be set in env")
 
-client = OpenAI(base_url=LM_BASE_URL, api_key=LM_API_KEY)
+client = AsyncOpenAI(base_url=LM_BASE_URL, api_key=LM_API_KEY)
 
+# History window sent to the model. It only grows between resets so the
+# provider's prompt cache keeps hitting on the shared prefix.
+_WINDOW_MIN = 10
+_WINDOW_MAX = 20
+_window_start = 1  # index 0 is the system prompt, which is always sent
 
-def run_turn(messages: List[Dict[str, Any]]):
-    # First call with tools (not streaming just tools)
-    resp = client.chat.completions.create(
+
+def _advance_window(messages: List[Dict[str, Any]]) -> None:
+    global _window_start
+    if len(messages) - _window_start <= _WINDOW_MAX:
+        return
+    start = _window_start + (_WINDOW_MAX - _WINDOW_MIN)
+    # Only cut at a user message so tool results never lose their tool_calls
+    while start < len(messages) - 1 and messages[start]["role"] != "user":
+        start += 1
+    _window_start = start
+
+
+def _windowed(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [messages[0]] + messages[_window_start:]
+
+
+def _call_tool(name: str, arguments: str) -> str:
+    args = orjson.loads(arguments or "{}")
+    return execute_function(name, args)
+
+
+class _ArgsScanner:
+    """Track brace depth over streamed tool arguments, one character at a time.
+
+    Tool arguments are always a top-level JSON object, so the object is
+    complete once depth returns to zero outside a string.
+    """
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.complete = False
+
+    def feed(self, text: str) -> bool:
+        for ch in text:
+            if self.complete:
+                break
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}":
+                self.depth -= 1
+                self.complete = self.depth == 0
+        return self.complete
+
+
+def _dispatch(call: Dict[str, Any]) -> None:
+    call["task"] = asyncio.create_task(
+        asyncio.to_thread(_call_tool, call["name"], call["args"])
+    )
+
+
+async def _from_batch(batch: asyncio.Task, assignment_id: int) -> str:
+    return (await batch)[assignment_id]
+
+
+def _dispatch_submission_statuses(calls: List[Dict[str, Any]]) -> None:
+    """Issue one submissions request per course for get_submission_status calls.
+
+    Courses with a single call, and calls whose arguments don't parse, go
+    through the regular per-call path.
+    """
+    by_course: Dict[int, List[Tuple[Dict[str, Any], int]]] = {}
+    for call in calls:
+        try:
+            args = orjson.loads(call["args"] or "{}")
+            aid = int(args["assignment_id"])
+            key = (resolve_course_id(aid, args.get("course_id")), aid)
+        except (orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+            _dispatch(call)
+            continue
+        by_course.setdefault(key[0], []).append((call, key[1]))
+
+    for course_id, group in by_course.items():
+        if len(group) == 1:
+            _dispatch(group[0][0])
+            continue
+        aids = list(dict.fromkeys(aid for _, aid in group))
+        batch = asyncio.create_task(
+            asyncio.to_thread(get_submission_statuses, course_id, aids)
+        )
+        for call, aid in group:
+            call["task"] = asyncio.create_task(_from_batch(batch, aid))
+
+
+# Generic "what's due" questions, which get a fixed-format answer without a
+# second model call. The whole message must match, so anything narrower
+# (a course, a specific assignment, planning) goes to the model.
+_WINDOW = (
+    r"(?: (?:in|within|over|for)(?: the)? next(?: \d+| few| couple(?: of)?)? (?:days?|weeks?)"
+    r"| this week| next week| today| tomorrow| soon)?"
+)
+_LIST_DUE_RE = re.compile(
+    r"(?:"
+    rf"what(?:'s| is| are)? (?:due|upcoming|coming up){_WINDOW}"
+    rf"|what do i have (?:due|coming up){_WINDOW}"
+    rf"|(?:what|which) (?:are )?(?:my )?(?:upcoming )?assignments(?: do i have)?(?: are)?(?: due| coming up)?{_WINDOW}"
+    rf"|(?:list|show)(?: me)?(?: my| all| all my)? (?:upcoming )?assignments(?: due)?{_WINDOW}"
+    r")"
+)
+
+
+def _is_listing_question(user_msg: str) -> bool:
+    text = " ".join(user_msg.lower().replace("\u2019", "'").split()).rstrip("?.! ")
+    return _LIST_DUE_RE.fullmatch(text) is not None
+
+
+def _render_assignments(user_msg: str, call: Dict[str, Any], result: Any) -> Optional[str]:
+    """Format a get_upcoming_assignments result directly, or None to ask the model."""
+    if call["name"] != "get_upcoming_assignments" or not isinstance(result, str):
+        return None
+    if not _is_listing_question(user_msg):
+        return None
+    try:
+        assignments = orjson.loads(result)["assignments"]
+        days = int(orjson.loads(call["args"] or "{}").get("days_ahead", DAYS_AHEAD_DEFAULT))
+    except (orjson.JSONDecodeError, KeyError, TypeError, ValueError, AttributeError):
+        return None
+    if not assignments:
+        window = "day" if days == 1 else f"{days} days"
+        return f"There are no assignments due in the next {window}."
+    lines = [f"• {a['course_name']} — {a['name']} — Due: {a['due_at']}" for a in assignments]
+    lines.append("(Ask me to adjust the window or schedule study time.)")
+    return "\n".join(lines)
+
+
+async def run_turn(messages: List[Dict[str, Any]]):
+    _advance_window(messages)
+    user_msg = messages[-1].get("content") or ""
+
+    # First call with tools, streamed so each tool starts as soon as its
+    # arguments finish arriving
+    stream = await client.chat.completions.create(
         model=LM_MODEL,
-        messages=messages,
+        messages=_windowed(messages),
         tools=TOOLS,
         tool_choice="auto",
         temperature=0.0,
+        stream=True,
     )
-    msg = resp.choices[0].message
 
-    if getattr(msg, "tool_calls", None):
-        # Record tool_calls in the transcript
+    calls: Dict[int, Dict[str, Any]] = {}  # stream index -> accumulated tool call
+    content_parts: List[str] = []
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        piece = getattr(delta, "content", None)
+        if piece and not calls:
+            print(piece, end="", flush=True)
+            content_parts.append(piece)
+        for tcd in getattr(delta, "tool_calls", None) or []:
+            call = calls.setdefault(
+                tcd.index,
+                {"id": None, "name": "", "args": "", "scan": _ArgsScanner(), "task": None},
+            )
+            if tcd.id:
+                call["id"] = tcd.id
+            if tcd.function:
+                call["name"] += tcd.function.name or ""
+                if tcd.function.arguments:
+                    call["args"] += tcd.function.arguments
+                    call["scan"].feed(tcd.function.arguments)
+            if (
+                call["task"] is None
+                and call["name"]
+                and call["name"] != "get_submission_status"  # batched below
+                and call["scan"].complete
+            ):
+                _dispatch(call)
+
+    if calls:
+        tool_calls = [calls[i] for i in sorted(calls)]
+        _dispatch_submission_statuses(
+            [c for c in tool_calls if c["task"] is None and c["name"] == "get_submission_status"]
+        )
+        for call in tool_calls:
+            if call["task"] is None:
+                _dispatch(call)
+
+        # Record tool_calls in the transcript, with any text already shown
+        if content_parts:
+            print()
         messages.append({
             "role": "assistant",
+            "content": "".join(content_parts) or None,
             "tool_calls": [
                 {
-                    "id": tc.id,
-                    "type": tc.type,
-                    "function": {
-                        "name": tc.function.name,
-                        "arguments": tc.function.arguments,
-                    },
+                    "id": call["id"],
+                    "type": "function",
+                    "function": {"name": call["name"], "arguments": call["args"]},
                 }
-                for tc in msg.tool_calls
+                for call in tool_calls
             ],
         })
 
-        # Execute tools
-        for tc in msg.tool_calls:
-            name = tc.function.name
-            args = json.loads(tc.function.arguments or "{}")
-            result = execute_function(name, args)
-            messages.append({"role": "tool", "tool_call_id": tc.id, "content": result})
+        # Results come back in tool_calls order
+        results = await asyncio.gather(
+            *(call["task"] for call in tool_calls), return_exceptions=True
+        )
+        for i, call in enumerate(tool_calls):
+            result = results[i]
+            if isinstance(result, Exception):
+                result = orjson.dumps({"error": f"{type(result).__name__}: {result}"}).decode()
+            messages.append({"role": "tool", "tool_call_id": call["id"], "content": result})
+
+        # A plain assignment listing doesn't need the model to reformat it
+        if len(tool_calls) == 1:
+            rendered = _render_assignments(user_msg, tool_calls[0], results[0])
+            if rendered is not None:
+                print(rendered)
+                messages.append({"role": "assistant", "content": rendered})
+                return rendered, messages
 
         # Second call (streaming the final answer)
-        stream = client.chat.completions.create(
+        stream = await client.chat.completions.create(
             model=LM_MODEL,
-            messages=messages,
+            messages=_windowed(messages),
             temperature=0.0,
             stream=True,
         )
 
         final_msg_parts: List[str] = []
-        for chunk in stream:
+        async for chunk in stream:
             delta = chunk.choices[0].delta
             piece = getattr(delta, "content", None)
             if piece:
@@ -84,35 +284,20 @@ def run_turn(messages: List[Dict[str, Any]]):
         messages.append({"role": "assistant", "content": final_msg})
         return final_msg, messages
 
-    # Stream resposne without tools
-    stream = client.chat.completions.create(
-        model=LM_MODEL,
-        messages=messages + [{"role": "assistant", "content": ""}],
-        stream=True,
-    )
-
-    content_parts: List[str] = []
-    for chunk in stream:
-        delta = chunk.choices[0].delta
-        piece = getattr(delta, "content", None)
-        if piece:
-            print(piece, end="", flush=True)
-            content_parts.append(piece)
-
+    # No tools requested: the streamed first response is the answer
     print()
     content = "".join(content_parts) or ""
     messages.append({"role": "assistant", "content": content})
     return content, messages
 
 
-
-def main():
+async def main():
     system_prompt = f"""
     You can call tools to help plan study time for Canvas assignments.
 
     TOOLS YOU CAN CALL:
     - get_upcoming_assignments(days_ahead)
-    - get_submission_status(course_id, assignment_id)
+    - get_submission_status(assignment_id, course_id optional)
     - create_canvas_event(title, start_at, end_at)
 
     Instructions:
@@ -144,9 +329,9 @@ def main():
             break
 
         conversation.append({"role": "user", "content": user})
-        reply, convo = run_turn(conversation)
+        reply, convo = await run_turn(conversation)
         print(f"Assistant: {reply}")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
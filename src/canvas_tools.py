@@ -5,16 +5,21 @@ Canvas tools module: Canvas API helpers, tool functions, JSON schemas, and a dis
 from __future__ import annotations
 
 import os
-import json
+import functools
+import itertools
+import logging
 import re
 import html
-import hashlib
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
-import requests
-from dateutil import parser as dateparser
+import httpx
+import orjson
+import xxhash
+from dateutil.parser import isoparse
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -22,32 +27,101 @@ load_dotenv()
 CANVAS_BASE_URL = os.environ["CANVAS_BASE_URL"].rstrip("/")
 CANVAS_TOKEN = os.environ["CANVAS_TOKEN"]
 DAYS_AHEAD_DEFAULT = int(os.getenv("DAYS_AHEAD_DEFAULT"))
+LOG_LEVEL = logging.getLevelName(os.getenv("LOG_LEVEL", "WARNING").upper())
+if not isinstance(LOG_LEVEL, int):
+    LOG_LEVEL = logging.WARNING
 
-SESSION = requests.Session()
-SESSION.headers.update({"Authorization": f"Bearer {CANVAS_TOKEN}"})
-STATE_FILE = "created_blocks_canvas.json"
+# One pooled HTTP/2 client so concurrent requests multiplex over a single connection.
+SESSION = httpx.Client(
+    http2=True,
+    headers={"Authorization": f"Bearer {CANVAS_TOKEN}"},
+    timeout=30.0,
+    follow_redirects=True,  # requests.Session did; vanity domains redirect
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+)
+STATE_FILE = "created_blocks_canvas.json"  # legacy full-rewrite format, read-only
+SEEN_LOG_FILE = "created_blocks_canvas.jsonl"
 
+_SCRIPT_STYLE_RE = re.compile(r"<(script|style).*?</\1>", re.S | re.I)
+_TAG_RE = re.compile(r"<[^>]+>")
+_WS_RE = re.compile(r"\s+")
 
-def log(msg: str) -> None:
-    print(f"[{datetime.now().isoformat()}] {msg}", flush=True)
 
+_last_ts_sec = -1
+_last_ts_str = ""
 
-def canvas_get(path: str, params: Optional[Dict[str, Any]] = None) -> Any:
-    url = f"{CANVAS_BASE_URL}{path}"
+
+def _timestamp() -> str:
+    # Re-format at most once per second
+    global _last_ts_sec, _last_ts_str
+    now = int(time.time())
+    if now != _last_ts_sec:
+        _last_ts_str = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now))
+        _last_ts_sec = now
+    return _last_ts_str
+
+
+def log(msg: str, level: int = logging.INFO) -> None:
+    if level < LOG_LEVEL:
+        return
+    print(f"[{_timestamp()}] {msg}", flush=True)
+
+
+# GET responses keyed by URL + params -> (etag, body, next page URL)
+_RESP_CACHE: Dict[str, Tuple[str, Any, Optional[str]]] = {}
+
+
+def _cache_key(url: str, params: Optional[Dict[str, Any]]) -> str:
+    return f"{url}|{sorted((params or {}).items())!r}"
+
+
+def _get(url: str, params: Optional[Dict[str, Any]]) -> Tuple[Any, Optional[str]]:
+    """GET with ETag revalidation. Returns (body, next page URL)."""
+    key = _cache_key(url, params)
+    cached = _RESP_CACHE.get(key)
+    headers = {"If-None-Match": cached[0]} if cached else None
     log(f"GET {url} | params={params}")
     t0 = time.time()
-    r = SESSION.get(url, params=params or {}, timeout=30)
+    r = SESSION.get(url, params=params, headers=headers)
+    if cached and r.status_code == 304:
+        log(f"✔ GET {url} (not modified, {time.time() - t0:.2f}s)")
+        return cached[1], cached[2]
     r.raise_for_status()
     log(f"✔ GET {url} ({time.time() - t0:.2f}s)")
-    return r.json()
+    body = r.json()
+    next_url = r.links.get("next", {}).get("url")
+    etag = r.headers.get("ETag")
+    if etag:
+        _RESP_CACHE[key] = (etag, body, next_url)
+    return body, next_url
+
+
+def canvas_get(path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+    return _get(f"{CANVAS_BASE_URL}{path}", params)[0]
+
+
+def canvas_get_paginated(
+    path: str, params: Optional[Dict[str, Any]] = None
+) -> Iterator[List[Any]]:
+    """Yield each page of a Canvas list endpoint, following Link rel="next"."""
+    url: Optional[str] = f"{CANVAS_BASE_URL}{path}"
+    while url:
+        page, url = _get(url, params)
+        yield page or []
+        # The next link already carries the query string
+        params = None
+
+
+def canvas_get_all(path: str, params: Optional[Dict[str, Any]] = None) -> List[Any]:
+    return list(itertools.chain.from_iterable(canvas_get_paginated(path, params)))
 
 
 def canvas_post(path: str, payload: Dict[str, Any]) -> Any:
     url = f"{CANVAS_BASE_URL}{path}"
-    preview = json.dumps(payload)[:200]
+    preview = orjson.dumps(payload)[:200].decode(errors="ignore")
     log(f"POST {url} | payload={preview}...")
     t0 = time.time()
-    r = SESSION.post(url, json=payload, timeout=30)
+    r = SESSION.post(url, json=payload)
     r.raise_for_status()
     log(f"✔ POST {url} ({time.time() - t0:.2f}s)")
     return r.json()
@@ -56,9 +130,9 @@ def canvas_post(path: str, payload: Dict[str, Any]) -> Any:
 def strip_html(s: Optional[str]) -> str:
     if not s:
         return ""
-    s = re.sub(r"<(script|style).*?</\\1>", "", s, flags=re.S | re.I)
-    s = re.sub(r"<[^>]+>", " ", s)
-    return re.sub(r"\s+", " ", html.unescape(s)).strip()
+    s = _SCRIPT_STYLE_RE.sub("", s)
+    s = _TAG_RE.sub(" ", s)
+    return _WS_RE.sub(" ", html.unescape(s)).strip()
 
 
 def iso(dt: datetime) -> str:
@@ -68,89 +142,169 @@ def iso(dt: datetime) -> str:
 
 
 def _load_seen() -> Set[str]:
+    seen: Set[str] = set()
+    try:
+        with open(STATE_FILE, "rb") as f:
+            seen.update(orjson.loads(f.read()))
+    except Exception:
+        pass
     try:
-        with open(STATE_FILE, "r") as f:
-            return set(json.load(f))
+        with open(SEEN_LOG_FILE, "rb") as f:
+            lines = f.readlines()
     except Exception:
-        return set()
+        lines = []
+    for line in lines:
+        try:
+            seen.add(orjson.loads(line))
+        except Exception:
+            continue  # blank or partially written line
+    return seen
+
+
+def _reserve_seen(h: str) -> bool:
+    """Atomically claim h; False if it was already created or in flight."""
+    with _SEEN_LOCK:
+        if h in _SEEN:
+            return False
+        _SEEN.add(h)
+        return True
+
 
+def _release_seen(h: str) -> None:
+    with _SEEN_LOCK:
+        _SEEN.discard(h)
 
-def _save_seen(seen: Set[str]) -> None:
-    with open(STATE_FILE, "w") as f:
-        json.dump(sorted(list(seen)), f, indent=2)
+
+def _record_seen(h: str) -> None:
+    with _SEEN_LOCK:
+        with open(SEEN_LOG_FILE, "ab") as f:
+            f.write(orjson.dumps(h) + b"\n")
+
+
+_SEEN: Set[str] = _load_seen()
+_SEEN_LOCK = threading.Lock()
 
 
 def _hash_block(title: str, start_iso: str, end_iso: str) -> str:
-    return hashlib.sha1(f"{title}|{start_iso}|{end_iso}".encode()).hexdigest()
+    return xxhash.xxh3_64_hexdigest(f"{title}|{start_iso}|{end_iso}")
 
 
+@functools.lru_cache(maxsize=1)
 def _get_user_id() -> int:
     me = canvas_get("/api/v1/users/self")
     return int(me["id"])
 
 
+# Full records from get_upcoming_assignments, keyed by assignment_id. The
+# model only sees a compact view; follow-up tools look details up here.
+_LAST_ASSIGNMENTS_BY_ID: Dict[int, Dict[str, Any]] = {}
+
+
+def resolve_course_id(assignment_id: int, course_id: Optional[int] = None) -> int:
+    """Return course_id, or look it up from the last assignment listing."""
+    if course_id is not None:
+        return int(course_id)
+    rec = _LAST_ASSIGNMENTS_BY_ID.get(int(assignment_id))
+    if rec is None:
+        raise ValueError(
+            f"Unknown assignment {assignment_id}; call get_upcoming_assignments first"
+        )
+    return int(rec["course_id"])
+
+
 def get_upcoming_assignments(days_ahead: int = DAYS_AHEAD_DEFAULT) -> str:
-    """Return a JSON string: {"assignments": [...]} with cleaned fields.
+    """Return a JSON string: {"assignments": [...]} with compact fields.
 
-    Each item contains: course_name, name, due_at (ISO), points_possible,
-    submission_types, html_url, summary_line.
+    Each item contains: assignment_id, course_name, name, due_at (ISO). The
+    full records (points_possible, submission_types, html_url, course_id) of
+    this listing replace _LAST_ASSIGNMENTS_BY_ID.
     """
+    global _LAST_ASSIGNMENTS_BY_ID
     log(f"→ get_upcoming_assignments(days_ahead={days_ahead})")
     horizon = datetime.now(timezone.utc) + timedelta(days=int(days_ahead))
 
-    courses = canvas_get(
+    courses = canvas_get_all(
         "/api/v1/courses", params={"enrollment_state": "active", "per_page": 100}
     )
 
-    out: List[Dict[str, Any]] = []
+    course_names: Dict[Any, str] = {}
     for c in courses or []:
         cid = c.get("id")
-        cname = c.get("name") or f"Course {cid}"
         if not cid:
             continue
-        items = canvas_get(
-            f"/api/v1/courses/{cid}/assignments",
-            params={"bucket": "upcoming", "per_page": 100},
-        )
+        course_names[cid] = c.get("name") or f"Course {cid}"
+
+    # Fetch each course's assignments concurrently; filtering stays on this thread.
+    fetched: Dict[Any, Any] = {}
+    if course_names:
+        with ThreadPoolExecutor(max_workers=min(16, len(course_names))) as pool:
+            futures = {
+                pool.submit(
+                    canvas_get_all,
+                    f"/api/v1/courses/{cid}/assignments",
+                    {"bucket": "upcoming", "order_by": "due_at", "per_page": 100},
+                ): cid
+                for cid in course_names
+            }
+            for fut in as_completed(futures):
+                cid = futures[fut]
+                try:
+                    fetched[cid] = fut.result()
+                except Exception as e:
+                    log(
+                        f"✖ Failed to fetch assignments for course {cid}: {e}",
+                        logging.WARNING,
+                    )
+
+    out: List[Dict[str, Any]] = []
+    for cid, cname in course_names.items():
+        items = fetched.get(cid)
         for a in items or []:
             due_at = a.get("due_at")
             if not due_at:
                 continue
             try:
-                due = dateparser.parse(due_at)
+                due = isoparse(due_at)
             except Exception:
                 continue
             if due <= horizon:
                 points = a.get("points_possible")
                 subs = a.get("submission_types", [])
-                summary_line = f"**{cname}** — {a.get('name')} — Due: {due.isoformat()}"
+                due_iso = due.isoformat()
                 out.append(
                     {
                         "course_name": cname,
                         "name": a.get("name"),
-                        "due_at": due.isoformat(),
+                        "due_at": due_iso,
                         "points_possible": points,
                         "submission_types": subs,
                         "html_url": a.get("html_url"),
-                        "summary_line": summary_line,
                         "course_id": cid,
                         "assignment_id": a.get("id"),
                     }
                 )
 
+    # Each course arrives pre-sorted by due date, so this only merges the runs.
     out.sort(key=lambda x: x.get("due_at") or "")
+    # Rebind rather than mutate so concurrent lookups see one listing or the other
+    _LAST_ASSIGNMENTS_BY_ID = {
+        a["assignment_id"]: a for a in out if a.get("assignment_id") is not None
+    }
+    compact = [
+        {
+            "assignment_id": a["assignment_id"],
+            "course_name": a["course_name"],
+            "name": a["name"],
+            "due_at": a["due_at"],
+        }
+        for a in out
+    ]
     log(f"← Found {len(out)} upcoming assignments")
-    return json.dumps({"assignments": out})
+    return orjson.dumps({"assignments": compact}).decode()
 
 
-def get_submission_status(course_id: int, assignment_id: int) -> str:
-    log(
-        f"→ get_submission_status(course_id={course_id}, assignment_id={assignment_id})"
-    )
-    sub = canvas_get(
-        f"/api/v1/courses/{course_id}/assignments/{assignment_id}/submissions/self"
-    )
-    status = {
+def _submission_status(sub: Dict[str, Any]) -> Dict[str, Any]:
+    return {
         "late": sub.get("late"),
         "missing": sub.get("missing"),
         "submitted_at": sub.get("submitted_at"),
@@ -158,8 +312,47 @@ def get_submission_status(course_id: int, assignment_id: int) -> str:
         "workflow_state": sub.get("workflow_state"),
         "score": sub.get("score"),
     }
+
+
+def get_submission_status(assignment_id: int, course_id: Optional[int] = None) -> str:
+    log(
+        f"→ get_submission_status(course_id={course_id}, assignment_id={assignment_id})"
+    )
+    course_id = resolve_course_id(assignment_id, course_id)
+    sub = canvas_get(
+        f"/api/v1/courses/{course_id}/assignments/{assignment_id}/submissions/self"
+    )
+    status = _submission_status(sub)
     log(f"← Submission status: {status}")
-    return json.dumps(status)
+    return orjson.dumps(status).decode()
+
+
+def get_submission_statuses(course_id: int, assignment_ids: List[int]) -> Dict[int, str]:
+    """Batch form of get_submission_status for several assignments in one course.
+
+    Returns {assignment_id: JSON string}, each shaped like get_submission_status.
+    """
+    log(
+        f"→ get_submission_statuses(course_id={course_id}, assignment_ids={assignment_ids})"
+    )
+    subs = canvas_get_all(
+        f"/api/v1/courses/{course_id}/students/submissions",
+        params={
+            "student_ids[]": "self",
+            "assignment_ids[]": list(assignment_ids),
+            "per_page": 100,
+        },
+    )
+    by_id = {int(sub["assignment_id"]): sub for sub in subs if sub.get("assignment_id")}
+    out: Dict[int, str] = {}
+    for aid in assignment_ids:
+        sub = by_id.get(int(aid))
+        if sub is None:
+            out[aid] = orjson.dumps({"error": f"No submission found for assignment {aid}"}).decode()
+        else:
+            out[aid] = orjson.dumps(_submission_status(sub)).decode()
+    log(f"← Submission statuses for {len(by_id)} of {len(assignment_ids)} assignments")
+    return out
 
 
 def create_canvas_event(title: str, start_at: str, end_at: str) -> str:
@@ -182,11 +375,10 @@ def create_canvas_event(title: str, start_at: str, end_at: str) -> str:
     user_id = _get_user_id()
     context_code = f"user_{user_id}"
 
-    seen = _load_seen()
     h = _hash_block(title, start_at, end_at)
-    if h in seen:
+    if not _reserve_seen(h):
         log(f"↷ Skipping duplicate event: {title}")
-        return json.dumps({"created": [], "count": 0, "skipped": True})
+        return orjson.dumps({"created": [], "count": 0, "skipped": True}).decode()
 
     payload = {
         "calendar_event": {
@@ -199,13 +391,16 @@ def create_canvas_event(title: str, start_at: str, end_at: str) -> str:
         }
     }
 
-    res = canvas_post("/api/v1/calendar_events", payload)
-    seen.add(h)
-    _save_seen(seen)
+    try:
+        res = canvas_post("/api/v1/calendar_events", payload)
+    except Exception:
+        _release_seen(h)
+        raise
+    _record_seen(h)
 
     out = {"id": res.get("id"), "title": title, "start_at": start_at, "end_at": end_at}
     log("← Created 1 event")
-    return json.dumps({"created": [out], "count": 1})
+    return orjson.dumps({"created": [out], "count": 1}).decode()
 
 
 def execute_function(name: str, args: Dict[str, Any]) -> str:
@@ -215,7 +410,7 @@ def execute_function(name: str, args: Dict[str, Any]) -> str:
         return get_submission_status(**args)
     if name == "create_canvas_event":
         return create_canvas_event(**args)
-    return json.dumps({"error": f"Unknown tool {name}"})
+    return orjson.dumps({"error": f"Unknown tool {name}"}).decode()
 
 
 TOOLS: List[Dict[str, Any]] = [
@@ -247,10 +442,13 @@ TOOLS: List[Dict[str, Any]] = [
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "course_id": {"type": "integer"},
                     "assignment_id": {"type": "integer"},
+                    "course_id": {
+                        "type": "integer",
+                        "description": "Optional for assignments returned by get_upcoming_assignments.",
+                    },
                 },
-                "required": ["course_id", "assignment_id"],
+                "required": ["assignment_id"],
                 "additionalProperties": False,
             },
         },